@@ -155,7 +155,7 @@ docker run --rm \
     -w /work \
     ghcr.io/osgeo/gdal:alpine-normal-latest \
     sh -c "
-    apk add --no-cache python3 py3-pip py3-numpy py3-scipy && \
+    apk add --no-cache python3 py3-pip py3-numpy && \
     python3 $PYTHON_SCRIPT '$CLEANED_FILE' '$OUTPUT_DIR' $MIN_ZOOM $MAX_ZOOM $TILE_SIZE $PROCESSES '$TARGET_TILES_CSV'
     "
 
@@ -10,25 +10,6 @@ import sys
 import argparse
 
 
-def deg2num(lat_deg, lon_deg, zoom):
-    """
-    緯度経度からタイル座標への変換
-    
-    Args:
-        lat_deg (float): 緯度（度）
-        lon_deg (float): 経度（度）
-        zoom (int): ズームレベル
-        
-    Returns:
-        tuple: (x, y) タイル座標
-    """
-    lat_rad = math.radians(lat_deg)
-    n = 2.0 ** zoom
-    x = int((lon_deg + 180.0) / 360.0 * n)
-    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
-    return (x, y)
-
-
 def mercator_to_latlon(x, y):
     """
     Web Mercator (EPSG:3857) から WGS84 (EPSG:4326) への変換
@@ -72,22 +53,30 @@ def calculate_edge_tiles(min_x, min_y, max_x, max_y, zoom_range):
     # 端のタイル座標を格納するセット
     edge_tiles = set()
     
+    # 四隅の正規化タイル座標（0〜1）をズームレベルに依存しない部分として先に計算
+    # Web Mercatorタイル座標系ではY座標は北から南に向かって増加
+    ax_min = (min_lon + 180.0) / 360.0  # 左
+    ax_max = (max_lon + 180.0) / 360.0  # 右
+    ay_min = (1.0 - math.asinh(math.tan(math.radians(max_lat))) / math.pi) / 2.0  # 上
+    ay_max = (1.0 - math.asinh(math.tan(math.radians(min_lat))) / math.pi) / 2.0  # 下
+    
     for z in range(min_zoom, max_zoom + 1):
-        # 四隅のタイル座標を取得
-        # Web Mercatorタイル座標系ではY座標は北から南に向かって増加
-        min_x_tile, min_y_tile = deg2num(max_lat, min_lon, z)  # 左上
-        max_x_tile, max_y_tile = deg2num(min_lat, max_lon, z)  # 右下
+        # 四隅のタイル座標を取得（正規化座標にタイル数を掛けて切り捨て）
+        n = float(1 << z)
+        min_x_tile, min_y_tile = int(ax_min * n), int(ay_min * n)  # 左上
+        max_x_tile, max_y_tile = int(ax_max * n), int(ay_max * n)  # 右下
         
         # 端のタイルを特定（境界の1タイル幅）
+        xs = range(min_x_tile, max_x_tile + 1)
+        ys = range(min_y_tile, max_y_tile + 1)
+        
         # 上端と下端の全タイル
-        for x in range(min_x_tile, max_x_tile + 1):
-            edge_tiles.add((z, x, min_y_tile))      # 上端（北側）
-            edge_tiles.add((z, x, max_y_tile))      # 下端（南側）
+        edge_tiles.update((z, x, min_y_tile) for x in xs)      # 上端（北側）
+        edge_tiles.update((z, x, max_y_tile) for x in xs)      # 下端（南側）
         
         # 左端と右端の全タイル
-        for y in range(min_y_tile, max_y_tile + 1):
-            edge_tiles.add((z, min_x_tile, y))      # 左端（西側）
-            edge_tiles.add((z, max_x_tile, y))      # 右端（東側）
+        edge_tiles.update((z, min_x_tile, y) for y in ys)      # 左端（西側）
+        edge_tiles.update((z, max_x_tile, y) for y in ys)      # 右端（東側）
     
     return edge_tiles
 
@@ -110,9 +99,7 @@ def main():
     )
     
     # 結果を出力
-    output_lines = []
-    for z, x, y in sorted(edge_tiles):
-        output_lines.append(f'{z}/{x}/{y}')
+    output_lines = [f'{z}/{x}/{y}' for z, x, y in sorted(edge_tiles)]
     
     if args.output:
         with open(args.output, 'w') as f:
@@ -1,4 +1,18 @@
 import argparse
+import mmap
+import os
+
+# 補完に使うデータなし行（UTF-8バイト列として1度だけエンコード）
+PAD_LINE = "データなし,-9999.\n".encode("utf-8")
+
+# 修正後の <gml:startPoint> 行
+FIXED_START_POINT = b"<gml:startPoint>0 0</gml:startPoint>\n"
+
+# 出力バッファサイズ（1 MiB）
+WRITE_BUFFER_SIZE = 1 << 20
+
+# 入力をコピーする際の1回あたりの目安サイズ（16 MiB）
+COPY_CHUNK_SIZE = 16 << 20
 
 # 引数を解析する
 def parse_arguments():
@@ -7,63 +21,99 @@ def parse_arguments():
     parser.add_argument("output_file", help="出力XMLファイルのパス")
     return parser.parse_args()
 
+def line_range(mm, pos):
+    """pos を含む行の開始位置と終了位置（改行の直後）を取得"""
+    start = mm.rfind(b"\n", 0, pos) + 1
+    end = mm.find(b"\n", pos)
+    return start, (len(mm) if end < 0 else end + 1)
+
+def copy_range(fout, mm, start, end):
+    """mmapの区間を出力にまとめてコピーし、含まれる行数を返す（改行コードはLFに揃える）"""
+    line_count = 0
+
+    while start < end:
+        stop = min(start + COPY_CHUNK_SIZE, end)
+        if stop < end:
+            # CRLFを分断しないよう改行の直後で区切る
+            newline = mm.find(b"\n", stop, end)
+            stop = end if newline < 0 else newline + 1
+
+        chunk = mm[start:stop]
+        line_count += chunk.count(b"\n")
+        fout.write(chunk.replace(b"\r\n", b"\n"))
+        start = stop
+
+    return line_count
+
 def fill_missing_data(input_file, output_file, total_rows=843750):
-    # ファイルをテキストとして読み込む
-    with open(input_file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
-    # <gml:tupleList> の開始と終了位置を特定
-    start_index = None
-    end_index = None
-
-    for i, line in enumerate(lines):
-        if "<gml:tupleList>" in line:
-            start_index = i
-        elif "</gml:tupleList>" in line:
-            end_index = i
-            break
-
-    if start_index is None or end_index is None:
+    if os.path.getsize(input_file) == 0:
         print("<gml:tupleList> が見つかりませんでした。")
         return
 
-    # 現在のデータ行を取得
-    tuple_list_lines = lines[start_index + 1:end_index]
-
-    # <gml:startPoint> の値を確認して修正し、必要に応じて行を挿入
-    for i, line in enumerate(lines):
-        if "<gml:startPoint>" in line:
-            start_point_value = line.strip().replace("<gml:startPoint>", "").replace("</gml:startPoint>", "")
+    with open(input_file, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        # <gml:tupleList> の開始と終了位置を特定
+        start_tag = mm.find(b"<gml:tupleList>")
+        end_tag = mm.find(b"</gml:tupleList>", start_tag) if start_tag >= 0 else -1
+
+        if start_tag < 0 or end_tag < 0:
+            print("<gml:tupleList> が見つかりませんでした。")
+            return
+
+        # データ行は開始タグの次の行から終了タグの行の手前まで
+        data_start = line_range(mm, start_tag)[1]
+        data_end = max(data_start, line_range(mm, end_tag)[0])
+
+        # <gml:startPoint> の値を確認し、必要に応じて先頭に挿入する行数を決める
+        calculated_rows = 0
+        start_point_line = None
+        start_point = mm.find(b"<gml:startPoint>")
+        if start_point >= 0:
+            line_start, line_end = line_range(mm, start_point)
+            start_point_value = mm[line_start:line_end].decode("utf-8").strip() \
+                .replace("<gml:startPoint>", "").replace("</gml:startPoint>", "")
             x, y = map(int, start_point_value.split())
 
             if x != 0 or y != 0:
                 calculated_rows = x + 1125 * y
+                start_point_line = (line_start, line_end)
                 print(f"<gml:startPoint> 修正: {start_point_value} -> 0 0, データなし,-9999. を {calculated_rows} 行挿入")
 
-                # 値を修正
-                lines[i] = "<gml:startPoint>0 0</gml:startPoint>\n"
+        def copy_section(fout, begin, end):
+            # 区間内に <gml:startPoint> 行があれば修正した行に置き換える
+            if start_point_line is not None and begin <= start_point_line[0] < end:
+                count = copy_range(fout, mm, begin, start_point_line[0])
+                fout.write(FIXED_START_POINT)
+                return count + copy_range(fout, mm, start_point_line[1], end)
+            return copy_range(fout, mm, begin, end)
+
+        # 入力と出力が同じファイルでも壊さないよう、一時ファイルに書き出してから置き換える
+        temp_file = output_file + ".tmp"
+
+        with open(temp_file, "wb", buffering=WRITE_BUFFER_SIZE) as fout:
+            copy_section(fout, 0, data_start)
 
-                # データなし行を挿入
-                extra_lines = ["データなし,-9999.\n"] * calculated_rows
-                tuple_list_lines = extra_lines + tuple_list_lines
+            # データなし行を挿入
+            fout.write(PAD_LINE * calculated_rows)
 
-    current_count = len(tuple_list_lines)
+            # 現在のデータ行をそのままコピー
+            current_count = calculated_rows + copy_section(fout, data_start, data_end)
 
-    # 不足分を計算
-    missing_count = total_rows - current_count
+            # 不足分を計算
+            missing_count = total_rows - current_count
 
-    if missing_count > 0:
-        print(f"不足している行数: {missing_count} をデータなしで補完")
-        # 不足分を補う
-        missing_data = ["データなし,-9999.\n"] * missing_count
-        tuple_list_lines.extend(missing_data)
+            if missing_count > 0:
+                print(f"不足している行数: {missing_count} をデータなしで補完")
+                # 不足分を補う
+                fout.write(PAD_LINE * missing_count)
 
-    # <gml:tupleList> の内容を更新
-    updated_lines = lines[:start_index + 1] + tuple_list_lines + lines[end_index:]
+            copy_section(fout, data_end, len(mm))
+    finally:
+        mm.close()
 
-    # 更新された内容を出力ファイルに書き込む
-    with open(output_file, "w", encoding="utf-8", newline="") as f:
-        f.writelines(updated_lines)
+    os.replace(temp_file, output_file)
 
 if __name__ == "__main__":
     args = parse_arguments()
@@ -2,11 +2,12 @@
 import os
 import sys
 import math
+import functools
 import numpy as np
-from scipy import ndimage
 from multiprocessing import Pool, cpu_count
 import time
 import csv
+import warnings
 
 # Try to import GDAL, fallback if not available
 try:
@@ -16,25 +17,89 @@ except ImportError:
     HAS_GDAL = False
     print("Warning: GDAL not available, some functions may not work")
 
+# Try to import terrain RGB encoder (requires Pillow), fallback if not available
+try:
+    from terrainrgb import save_terrain_rgb_png
+    HAS_TERRAINRGB = True
+except ImportError:
+    HAS_TERRAINRGB = False
+
+# タイル出力形式（txt: 標高テキスト, png: terrain RGB PNG, both: 両方）
+TILE_FORMATS = ('txt', 'png', 'both')
+
+# ピラミッド生成で親タイルとして読み込む作業データ（float32バイナリ）の拡張子
+PYRAMID_WORK_EXT = '.npy'
+
+# タイル座標(x, y)を1つの整数キーにまとめる際のyのビット幅（ズームレベル29まで対応）
+TILE_KEY_SHIFT = 29
+
+# ベースタイル生成で1回のラスター読み込みにまとめる範囲の上限（1辺あたりのピクセル数）
+# 1タイルがこれを超える低ズームでは1タイルずつ読み込む
+BASE_BLOCK_MAX_PIXELS = 2048
+
+# プロセス内で使い回す読み込みバッファの上限（要素数）。これを超える読み込みは都度確保して解放する
+READ_BUFFER_MAX_SIZE = 2 * BASE_BLOCK_MAX_PIXELS ** 2
+
+# ピラミッド生成で1タスクがメモリ上で連続して生成するズームレベル数
+# （作業データはこの段数ごとにしか書き出さない。親タイルは1タスクあたり最大 4^段数 枚）
+PYRAMID_SUBTREE_DEPTH = 3
+
+# Web Mercator (EPSG:3857) 変換用の定数
+MERC_SCALE = 20037508.342789244
+MERC_OVER_PI = MERC_SCALE / math.pi
+MERC_OVER_180 = MERC_SCALE / 180.0
+HALF_PI_OVER_180 = math.pi / 360.0
+
+# GDALブロックキャッシュの上限（全プロセス合計、物理メモリの半分を超えない範囲）
+GDAL_CACHE_MAX = 2 * 1024 ** 3
+
+# ラスター読み込み用の作業バッファ（プロセスごとに1つを使い回す）
+_read_buffer = np.empty(0, dtype=np.float32)
+
+# ベースタイルの標高グリッド（プロセスごとに1つを使い回す）
+_elevation_grid = np.empty((0, 0), dtype=np.float32)
+
+# テキストタイル1行分の書式文字列（列数ごとに1度だけ生成）
+_row_formats = {}
+
+# ワーカープロセスごとに保持するGDALデータセット
+_worker_dataset = None
+_worker_input_file = None
+
+# ワーカープロセスごとに保持するバンドとラスターサイズ（タイルごとのGDAL呼び出しを避ける）
+_worker_band = None
+_worker_raster_size = (0, 0)
+
+# ピラミッド生成ワーカーが参照するソースタイルと対象タイルの集合
+_pyramid_source_tiles = set()
+_pyramid_target_tiles = None
+
+def tile_key(tx, ty):
+    """タイル座標(x, y)を1つの整数キーに変換（NumPy配列にもそのまま適用できる）"""
+    return (tx << TILE_KEY_SHIFT) | ty
+
 def load_target_tiles(csv_file):
     """CSVファイルから対象タイルIDを読み込み"""
-    target_tiles = {}  # {zoom: set((x, y))}
+    target_tiles = {}  # {zoom: set(tile_key(x, y))}
     
     if not os.path.exists(csv_file):
         print(f"Warning: Target tiles CSV file not found: {csv_file}")
         return None
     
     try:
-        with open(csv_file, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                z = int(row['z'])
-                x = int(row['x'])
-                y = int(row['y'])
-                
-                if z not in target_tiles:
-                    target_tiles[z] = set()
-                target_tiles[z].add((x, y))
+        with open(csv_file, 'r', newline='') as f:
+            # ヘッダーからz, x, yの列位置を取得し、データ行はNumPyのCパーサーで一括読み込み（引用符付きの値にも対応）
+            header = next(csv.reader(f), [])
+            columns = [[name.strip() for name in header].index(name) for name in ('z', 'x', 'y')]
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)  # データ行がない場合の警告を抑制
+                rows = np.loadtxt(f, delimiter=',', dtype=np.int64, quotechar='"', usecols=columns, ndmin=2)
+        
+        # ズームレベルごとに整数キーの集合にまとめる
+        zooms = rows[:, 0]
+        keys = tile_key(rows[:, 1], rows[:, 2])
+        for z in np.unique(zooms).tolist():
+            target_tiles[z] = set(keys[zooms == z].tolist())
         
         # 統計情報を表示
         total_tiles = sum(len(tiles) for tiles in target_tiles.values())
@@ -49,126 +114,260 @@ def load_target_tiles(csv_file):
         print(f"Error loading target tiles CSV: {e}")
         return None
 
-def deg2num(lat_deg, lon_deg, zoom):
-    """緯度経度をタイル座標に変換"""
-    lat_rad = math.radians(lat_deg)
-    n = 2.0 ** zoom
-    xtile = int((lon_deg + 180.0) / 360.0 * n)
-    ytile = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
-    return (xtile, ytile)
+def deg2num_vec(lats, lons, zoom):
+    """緯度経度の配列をタイル座標の配列に一括変換（範囲外はズームレベル内に丸める）"""
+    lat_rad = np.radians(lats)
+    n = float(1 << zoom)
+    xtiles = ((np.asarray(lons) + 180.0) / 360.0 * n).astype(np.int64)
+    ytiles = ((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n).astype(np.int64)
+    max_tile = (1 << zoom) - 1
+    return (np.clip(xtiles, 0, max_tile), np.clip(ytiles, 0, max_tile))
 
 def num2deg(xtile, ytile, zoom):
     """タイル座標を緯度経度に変換"""
-    n = 2.0 ** zoom
+    n = float(1 << zoom)
     lon_deg = xtile / n * 360.0 - 180.0
     lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * ytile / n)))
     lat_deg = math.degrees(lat_rad)
     return (lat_deg, lon_deg)
 
-def bilinear_interpolation(data, x, y, width, height):
-    """バイリニア補間で標高値を取得"""
-    # 座標の整数部分と小数部分を取得
-    x1 = int(np.floor(x))
-    y1 = int(np.floor(y))
-    x2 = min(x1 + 1, width - 1)
-    y2 = min(y1 + 1, height - 1)
+@functools.lru_cache(maxsize=None)
+def tile_unit_offsets(tile_size):
+    """タイル内グリッドポイントの相対位置（0〜1、端を含む）。全タイルで共有するため書き換え禁止"""
+    offsets = np.linspace(0.0, 1.0, tile_size)
+    offsets.setflags(write=False)
+    return offsets
+
+def wgs84_to_webmercator_vec(lats, lons):
+    """WGS84からWeb Mercatorに配列で一括変換（緯度・経度は別々の長さでもよい）"""
+    xs = np.asarray(lons) * MERC_OVER_180
+    ys = np.log(np.tan((90.0 + np.asarray(lats)) * HALF_PI_OVER_180)) * MERC_OVER_PI
+    return xs, ys
+
+def webmercator_to_wgs84(x, y):
+    """Web Mercatorから緯度経度に変換"""
+    lon = x / MERC_OVER_180
+    lat = math.atan(math.exp(y / MERC_OVER_PI)) / HALF_PI_OVER_180 - 90.0
+    return lat, lon
+
+def bilinear_interpolation(data, local_x, local_y, out=None):
+    """バイリニア補間でタイル全体の標高値を取得
     
-    # 範囲チェック
-    if x1 < 0 or y1 < 0 or x1 >= width or y1 >= height:
-        return np.nan
+    local_xは列方向（幅W）、local_yは行方向（高さH）の1次元ローカル座標。
+    戻り値は(H, W)のfloat32配列（outを指定した場合はoutに直接書き込む）。
     
-    # 小数部分
-    dx = x - x1
-    dy = y - y1
+    演算量は1点あたり数回の乗算のみでメモリ帯域が律速のため、重みもfloat32に揃えて
+    (H, W)の中間配列がfloat64に広がらないようにする。
+    """
+    height, width = data.shape
     
-    # 4つの角の値を取得
+    # 座標の整数部分と小数部分を取得
+    x1 = np.floor(local_x).astype(np.intp)
+    y1 = np.floor(local_y).astype(np.intp)
+    x2 = np.minimum(x1 + 1, width - 1)
+    y2 = np.minimum(y1 + 1, height - 1)
+    
+    # 小数部分（float32の重み）
+    dx = (local_x - x1).astype(np.float32)[np.newaxis, :]
+    dy = (local_y - y1).astype(np.float32)[:, np.newaxis]
+    
+    # 4つの角の値を取得（行→列の順に1次元ずつ取り出し、2次元の添字計算を避ける）
+    rows1 = data.take(y1, axis=0)
+    rows2 = data.take(y2, axis=0)
+    v11 = rows1.take(x1, axis=1)  # 左上
+    v21 = rows1.take(x2, axis=1)  # 右上
+    v12 = rows2.take(x1, axis=1)  # 左下
+    v22 = rows2.take(x2, axis=1)  # 右下
+    
+    if out is None:
+        out = np.empty((len(local_y), len(local_x)), dtype=np.float32)
+    
+    # バイリニア補間を実行（a + (b - a) * t の形で中間配列をその場で更新する）
+    # 上辺の補間
+    v_top = np.subtract(v21, v11)
+    v_top *= dx
+    v_top += v11
+    # 下辺の補間
+    v_bottom = np.subtract(v22, v12)
+    v_bottom *= dx
+    v_bottom += v12
+    # 縦方向の補間
+    v_bottom -= v_top
+    v_bottom *= dy
+    np.add(v_top, v_bottom, out=out)
+    
+    # 一部でもNaNがある場合は最近傍を使用
+    # （NaNは補間結果に伝播するため、角ごとに判定せず結果のNaNだけを見ればよい）
+    has_nan = np.isnan(out)
+    if not has_nan.any():
+        return out
+    
+    nearest = np.where(dy < 0.5,
+                       np.where(dx < 0.5, v11, v21),
+                       np.where(dx < 0.5, v12, v22))
+    np.copyto(out, nearest, where=has_nan)
+    
+    return out
+
+def get_worker_dataset(input_file):
+    """プロセス内で共有するGDALデータセットを取得（未オープンの場合のみ開く）"""
+    global _worker_dataset, _worker_input_file, _worker_band, _worker_raster_size
+    
+    if _worker_dataset is None or _worker_input_file != input_file:
+        _worker_dataset = gdal.Open(input_file, gdal.GA_ReadOnly)
+        _worker_input_file = input_file
+        if _worker_dataset:
+            _worker_band = _worker_dataset.GetRasterBand(1)
+            _worker_raster_size = (_worker_dataset.RasterXSize, _worker_dataset.RasterYSize)
+    
+    return _worker_dataset
+
+def gdal_cache_size(num_processes=1):
+    """1プロセスあたりのGDALブロックキャッシュサイズ（バイト）を計算"""
+    cache_max = GDAL_CACHE_MAX
     try:
-        v11 = data[y1, x1]  # 左上
-        v21 = data[y1, x2]  # 右上
-        v12 = data[y2, x1]  # 左下
-        v22 = data[y2, x2]  # 右下
-        
-        # NaNチェック
-        if np.isnan(v11) or np.isnan(v21) or np.isnan(v12) or np.isnan(v22):
-            # 一部でもNaNがある場合は最近傍を使用
-            if dx < 0.5 and dy < 0.5:
-                return v11
-            elif dx >= 0.5 and dy < 0.5:
-                return v21
-            elif dx < 0.5 and dy >= 0.5:
-                return v12
-            else:
-                return v22
-        
-        # バイリニア補間を実行
-        # 上辺の補間
-        v_top = v11 * (1 - dx) + v21 * dx
-        # 下辺の補間
-        v_bottom = v12 * (1 - dx) + v22 * dx
-        # 縦方向の補間
-        result = v_top * (1 - dy) + v_bottom * dy
-        
-        return result
-        
-    except IndexError:
-        return np.nan
+        physical_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        cache_max = min(cache_max, physical_memory // 2)
+    except (ValueError, OSError, AttributeError):
+        pass  # 物理メモリ量を取得できない環境では既定値を使う
+    return max(cache_max // max(1, num_processes), 64 * 1024 ** 2)
 
-def load_tile_data(tile_file):
-    """タイルファイルからデータを読み込み"""
-    if not os.path.exists(tile_file):
-        return None
+def init_base_tile_worker(input_file, cache_size=None):
+    """ベースタイル生成ワーカーの初期化（GDALデータセットを1度だけ開き、ブロックキャッシュを設定）"""
+    if cache_size:
+        gdal.SetCacheMax(cache_size)
+    get_worker_dataset(input_file)
+
+def get_read_buffer(height, width):
+    """ReadAsArray用の(height, width)のfloat32バッファを取得（必要時のみ拡張）"""
+    global _read_buffer
+    
+    # 上限を超える大きさは使い回さず、その読み込みだけの配列を返す
+    if height * width > READ_BUFFER_MAX_SIZE:
+        return np.empty((height, width), dtype=np.float32)
+    
+    if _read_buffer.size < height * width:
+        _read_buffer = np.empty(height * width, dtype=np.float32)
     
+    return _read_buffer[:height * width].reshape(height, width)
+
+def get_elevation_grid(tile_size):
+    """ベースタイル用の(tile_size, tile_size)のfloat32グリッドを0で初期化して取得"""
+    global _elevation_grid
+    
+    if _elevation_grid.shape != (tile_size, tile_size):
+        _elevation_grid = np.empty((tile_size, tile_size), dtype=np.float32)
+    
+    _elevation_grid.fill(0.0)
+    return _elevation_grid
+
+def load_tile_data(tile_file):
+    """作業データ（.npy）からタイルデータを読み込み（メモリマップで参照）"""
     try:
-        with open(tile_file, 'r') as f:
-            lines = f.readlines()
-        
-        data = []
-        for line in lines:
-            row = [float(x) for x in line.strip().split(',')]
-            data.append(row)
-        
-        return np.array(data, dtype=np.float32)
+        return np.load(tile_file, mmap_mode='r')
     except:
         return None
 
 def save_tile_data(data, tile_file):
-    """タイルデータをファイルに保存"""
-    os.makedirs(os.path.dirname(tile_file), exist_ok=True)
+    """タイルデータをファイルに保存（出力先ディレクトリは作成済みであること）"""
+    # 1行分の書式で各行をまとめて整形し、タイル全体を1回のwriteで書き出す
+    width = data.shape[1]
+    row_format = _row_formats.get(width)
+    if row_format is None:
+        row_format = _row_formats[width] = ','.join(['%.2f'] * width)
     
-    with open(tile_file, 'w') as f:
-        for row in range(data.shape[0]):
-            row_values = [f"{data[row, col]:.2f}" for col in range(data.shape[1])]
-            f.write(','.join(row_values))
-            f.write('\n')
+    text = '\n'.join([row_format % tuple(row) for row in data.tolist()]) + '\n'
+    
+    with open(tile_file, 'wb') as f:
+        f.write(text.encode('ascii'))
+
+def create_tile_dirs(zoom_dir, tile_xs):
+    """ズームレベル内のxディレクトリをタイル処理の前にまとめて作成"""
+    for tx in set(tile_xs):
+        os.makedirs(os.path.join(zoom_dir, str(tx)), exist_ok=True)
+
+def remove_empty_tile_dirs(zoom_dir, tile_xs):
+    """タイルが1つも出力されなかったxディレクトリを削除"""
+    for tx in set(tile_xs):
+        try:
+            os.rmdir(os.path.join(zoom_dir, str(tx)))
+        except OSError:
+            pass  # タイルが存在する（空でない）
+
+def save_tile(data, tile_base, tile_format, work_file=True):
+    """指定形式でタイルを保存（tile_baseは拡張子なしのパス、ディレクトリは作成済みであること）"""
+    if tile_format in ('txt', 'both'):
+        save_tile_data(data, tile_base + '.txt')
+    if tile_format in ('png', 'both'):
+        save_terrain_rgb_png(data, tile_base + '.png')
+    
+    # ピラミッド生成用の作業データ（次のピラミッド生成後に削除）
+    # 出力タイルの書き込みに成功したタイルのみ書き出し、失敗時は書きかけのファイルを残さない
+    if work_file:
+        work_path = tile_base + PYRAMID_WORK_EXT
+        try:
+            np.save(work_path, data.astype(np.float32, copy=False))
+        except Exception:
+            try:
+                os.remove(work_path)
+            except OSError:
+                pass
+            raise
+
+def remove_pyramid_work_files(output_dir, zoom, tiles):
+    """指定ズームレベルのピラミッド生成用作業データを削除（作業データを書き出したタイル座標の集合から直接パスを組み立てる）"""
+    zoom_dir = os.path.join(output_dir, str(zoom))
+    for tx, ty in tiles:
+        try:
+            os.remove(os.path.join(zoom_dir, str(tx), f"{ty}{PYRAMID_WORK_EXT}"))
+        except FileNotFoundError:
+            pass
 
 def downsample_tile(parent_tiles, tile_size):
-    """4つの親タイルから1つの子タイルをバイリニアリサンプリングで生成"""
-    # 4つの親タイルを結合して2x2のタイル配置を作成
-    top_row = np.hstack([parent_tiles[0], parent_tiles[1]])  # 左上, 右上
-    bottom_row = np.hstack([parent_tiles[2], parent_tiles[3]])  # 左下, 右下
-    combined = np.vstack([top_row, bottom_row])
-    
-    # バイリニア補間でダウンサンプリング
-    zoom_factor = tile_size / combined.shape[0]
-    downsampled = ndimage.zoom(combined, zoom_factor, order=1)  # order=1はバイリニア補間
-    
-    # 正確なタイルサイズに調整
-    if downsampled.shape[0] != tile_size or downsampled.shape[1] != tile_size:
-        # クロッピングまたはパディング
-        result = np.zeros((tile_size, tile_size), dtype=np.float32)
-        min_h = min(downsampled.shape[0], tile_size)
-        min_w = min(downsampled.shape[1], tile_size)
-        result[:min_h, :min_w] = downsampled[:min_h, :min_w]
-        return result
+    """4つの親タイルから1つの子タイルを2x2ブロック平均で生成（存在しない親タイルはNoneで0として扱う）
+    
+    倍率0.5のバイリニア補間は2x2ピクセルの平均に相当するため、親タイルを並べた配列を作らず
+    各親タイルを子タイルの1/4の領域に直接縮小する（tile_sizeは偶数であること）。
+    """
+    half = tile_size // 2
+    downsampled = np.empty((tile_size, tile_size), dtype=np.float32)
+    
+    quadrants = (
+        downsampled[:half, :half],  # 左上
+        downsampled[:half, half:],  # 右上
+        downsampled[half:, :half],  # 左下
+        downsampled[half:, half:],  # 右下
+    )
+    for quadrant, parent_data in zip(quadrants, parent_tiles):
+        if parent_data is None:
+            quadrant[...] = 0.0
+        else:
+            parent_data.reshape(half, 2, half, 2).mean(axis=(1, 3), dtype=np.float32, out=quadrant)
     
     return downsampled
 
-def generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, num_processes=None, target_tiles_csv=None):
+def generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, num_processes=None, target_tiles_csv=None, tile_format='txt'):
     """テキストタイルを生成（ピラミッド方式：z14から開始してリサンプリング）"""
     if not HAS_GDAL:
         print("Error: GDAL is required for this function")
         return False
     
+    if tile_format not in TILE_FORMATS:
+        print(f"Error: Unknown tile format: {tile_format}")
+        return False
+    
+    if min_zoom > max_zoom:
+        print(f"Error: min_zoom must not be greater than max_zoom: {min_zoom} > {max_zoom}")
+        return False
+    
+    if tile_size <= 0 or tile_size % 2 != 0:
+        print(f"Error: tile_size must be a positive even number: {tile_size}")
+        return False
+    
+    if tile_format != 'txt' and not HAS_TERRAINRGB:
+        print("Error: Pillow is required for terrain RGB PNG output")
+        return False
+    
     if num_processes is None:
         num_processes = min(cpu_count(), 8)  # 最大8プロセス
     
@@ -180,8 +379,13 @@ def generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, n
             print("Warning: Failed to load target tiles, proceeding with full tile generation")
     
     print(f"🚀 Starting text tile generation with {num_processes} processes")
+    print(f"🗂️  Tile format: {tile_format}")
     if target_tiles:
         print(f"🎯 Using target tiles from: {target_tiles_csv}")
+    # 隣接タイルが同じソースブロックを再利用できるようGDALのブロックキャッシュを拡大
+    gdal.SetCacheMax(gdal_cache_size())
+    print(f"🧠 GDAL cache max: {gdal.GetCacheMax() / 1024 ** 2:.0f} MB")
+    
     print(f"Opening raster: {input_file}")
     dataset = gdal.Open(input_file, gdal.GA_ReadOnly)
     if not dataset:
@@ -196,6 +400,7 @@ def generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, n
     print(f"Raster size: {dataset.RasterXSize} x {dataset.RasterYSize}")
     print(f"Geotransform: {geotransform}")
     print(f"NoData value: {nodata_value}")
+    print(f"Block size: {band.GetBlockSize()}")
     
     # Web Mercator EPSG:3857の範囲を取得
     minx = geotransform[0]
@@ -206,11 +411,6 @@ def generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, n
     print(f"Raster bounds (Web Mercator): {minx}, {miny}, {maxx}, {maxy}")
     
     # Web Mercatorから緯度経度に変換
-    def webmercator_to_wgs84(x, y):
-        lon = x * 180.0 / 20037508.342789244
-        lat = math.atan(math.exp(y * math.pi / 20037508.342789244)) * 360.0 / math.pi - 90.0
-        return lat, lon
-    
     min_lat, min_lon = webmercator_to_wgs84(minx, miny)
     max_lat, max_lon = webmercator_to_wgs84(maxx, maxy)
     
@@ -222,23 +422,38 @@ def generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, n
     # Step 1: 最高解像度（max_zoom、通常z14）のタイルを生成
     print(f"🚀 Generating base tiles at zoom level {max_zoom}")
     base_start_time = time.time()
-    base_zoom_tiles = generate_base_zoom_tiles(
+    # 出力したタイルの集合をズームレベルごとに保持し、次のピラミッド生成でディレクトリを再走査しない
+    produced_tiles_by_zoom = {}
+    produced_tiles_by_zoom[max_zoom] = generate_base_zoom_tiles(
         dataset, band, geotransform, nodata_value,
         minx, miny, maxx, maxy, min_lat, min_lon, max_lat, max_lon,
-        max_zoom, tile_size, output_dir, num_processes, target_tiles
+        max_zoom, tile_size, output_dir, num_processes, target_tiles, tile_format,
+        work_files=(max_zoom > min_zoom)
     )
+    base_zoom_tiles = len(produced_tiles_by_zoom[max_zoom])
     base_end_time = time.time()
     total_tiles += base_zoom_tiles
     print(f"✅ Generated {base_zoom_tiles} base tiles at zoom {max_zoom} in {base_end_time - base_start_time:.1f}s")
     
     # Step 2: ピラミッド生成（max_zoom-1からmin_zoomまで）
-    for zoom in range(max_zoom - 1, min_zoom - 1, -1):
-        print(f"🔄 Generating zoom level {zoom} from zoom {zoom + 1}")
+    # PYRAMID_SUBTREE_DEPTH段ずつ、中間ズームレベルをディスクに戻さずメモリ上で生成する
+    source_zoom = max_zoom
+    while source_zoom > min_zoom:
+        top_zoom = max(min_zoom, source_zoom - PYRAMID_SUBTREE_DEPTH)
+        print(f"🔄 Generating zoom levels {source_zoom - 1}-{top_zoom} from zoom {source_zoom}")
         pyramid_start_time = time.time()
-        pyramid_tiles = generate_pyramid_level(output_dir, zoom, zoom + 1, tile_size, target_tiles)
+        source_tiles = produced_tiles_by_zoom.pop(source_zoom)
+        level_counts, produced_tiles_by_zoom[top_zoom] = generate_pyramid_levels(
+            output_dir, top_zoom, source_zoom, source_tiles, tile_size, target_tiles, tile_format, num_processes,
+            keep_work_files=(top_zoom > min_zoom))
+        remove_pyramid_work_files(output_dir, source_zoom, source_tiles)
         pyramid_end_time = time.time()
-        total_tiles += pyramid_tiles
-        print(f"✅ Generated {pyramid_tiles} tiles for zoom {zoom} in {pyramid_end_time - pyramid_start_time:.1f}s")
+        for zoom in range(source_zoom - 1, top_zoom - 1, -1):
+            pyramid_tiles = level_counts.get(zoom, 0)
+            total_tiles += pyramid_tiles
+            print(f"✅ Generated {pyramid_tiles} tiles for zoom {zoom}")
+        print(f"  Completed zoom levels {source_zoom - 1}-{top_zoom} in {pyramid_end_time - pyramid_start_time:.1f}s")
+        source_zoom = top_zoom
     
     total_end_time = time.time()
     total_time = total_end_time - total_start_time
@@ -248,192 +463,257 @@ def generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, n
     dataset = None
     return True
 
-def generate_single_base_tile(args):
-    """単一のベースタイルを生成（マルチプロセッシング用）"""
-    (tx, ty, zoom, tile_size, input_file, output_dir, 
-     geotransform, nodata_value, minx, miny, maxx, maxy) = args
+def base_tile_window(tx, ty, zoom, geotransform, inv_gt1, inv_gt5, tile_span_merc, minx, miny, maxx, maxy, raster_size):
+    """ベースタイルの地理的範囲と読み込むピクセル範囲を計算
+    
+    戻り値は((north, south, west, east), (pixel_minx, pixel_miny, pixel_maxx, pixel_maxy))。
+    読み込み不要な場合はスキップ理由の文字列を返す。
+    """
+    raster_xsize, raster_ysize = raster_size
+    
+    # タイルの地理的範囲を計算（WGS84）
+    north, west = num2deg(tx, ty, zoom)
+    south, east = num2deg(tx + 1, ty + 1, zoom)
+    
+    # Web Mercatorでの範囲はタイル座標から直接計算（タイル幅はズームレベルごとに一定）
+    tile_west_merc = tx * tile_span_merc - MERC_SCALE
+    tile_east_merc = (tx + 1) * tile_span_merc - MERC_SCALE
+    tile_north_merc = MERC_SCALE - ty * tile_span_merc
+    tile_south_merc = MERC_SCALE - (ty + 1) * tile_span_merc
+    
+    # タイルとラスターの重複領域を計算
+    overlap_minx = max(tile_west_merc, minx)
+    overlap_maxx = min(tile_east_merc, maxx)
+    overlap_miny = max(tile_south_merc, miny)
+    overlap_maxy = min(tile_north_merc, maxy)
+    
+    # 重複がない場合はスキップ
+    if overlap_minx >= overlap_maxx or overlap_miny >= overlap_maxy:
+        return "No overlap"
+    
+    # ラスター座標系での範囲を計算
+    pixel_minx = max(0, int((overlap_minx - geotransform[0]) * inv_gt1))
+    pixel_maxx = min(raster_xsize, int((overlap_maxx - geotransform[0]) * inv_gt1) + 1)
+    pixel_miny = max(0, int((overlap_maxy - geotransform[3]) * inv_gt5))
+    pixel_maxy = min(raster_ysize, int((overlap_miny - geotransform[3]) * inv_gt5) + 1)
+    
+    if pixel_minx >= pixel_maxx or pixel_miny >= pixel_maxy:
+        return "Invalid pixel range"
+    
+    return (north, south, west, east), (pixel_minx, pixel_miny, pixel_maxx, pixel_maxy)
+
+def sample_base_tile(tx, ty, zoom, tile_size, output_dir, geotransform, inv_gt1, inv_gt5,
+                     bounds, window, data, tile_format, work_file):
+    """読み込み済みのラスター範囲（NoDataはNaN）から1タイル分をサンプリングして保存"""
+    north, south, west, east = bounds
+    pixel_minx, pixel_miny, pixel_maxx, pixel_maxy = window
+    
+    # 有効な値が1つもない場合はサンプリングせずにスキップ
+    if not np.isfinite(data).any():
+        return (tx, ty, False, "No data")
+    
+    # タイル内でのグリッドポイントを生成（緯度は行、経度は列ごとに一括計算）
+    unit = tile_unit_offsets(tile_size)
+    point_lat = north + (south - north) * unit
+    point_lon = west + (east - west) * unit
+    
+    # Web Mercator座標に変換（xは列、yは行ごとに1回だけ計算）
+    point_x, point_y = wgs84_to_webmercator_vec(point_lat, point_lon)
+    
+    # ラスター座標系に変換
+    raster_x = (point_x - geotransform[0]) * inv_gt1
+    raster_y = (point_y - geotransform[3]) * inv_gt5
+    
+    # ラスター範囲内の列・行を取得（座標は単調なので範囲内は連続した区間になる）
+    valid_cols = np.flatnonzero((pixel_minx <= raster_x) & (raster_x < pixel_maxx))
+    valid_rows = np.flatnonzero((pixel_miny <= raster_y) & (raster_y < pixel_maxy))
+    
+    # 範囲内のサンプル点が1つもなければ全面0になるためスキップ
+    if valid_cols.size == 0 or valid_rows.size == 0:
+        return (tx, ty, False, "No data")
+    
+    col_start, col_end = valid_cols[0], valid_cols[-1] + 1
+    row_start, row_end = valid_rows[0], valid_rows[-1] + 1
+    
+    # ローカル座標に変換（bilinear補間用）
+    local_x = raster_x[col_start:col_end] - pixel_minx
+    local_y = raster_y[row_start:row_end] - pixel_miny
+    
+    # 範囲内の矩形のみBilinear補間でグリッドに直接書き込み、範囲外は0のままとする
+    elevation_grid = get_elevation_grid(tile_size)
+    sampled = bilinear_interpolation(data, local_x, local_y,
+                                     out=elevation_grid[row_start:row_end, col_start:col_end])
+    
+    # 最近傍でも値がない点（NaN）を0に変換
+    np.nan_to_num(sampled, copy=False, nan=0.0)
+    
+    # 全面0.00の場合はタイル出力をスキップ
+    if not elevation_grid.any():
+        return (tx, ty, False, "All zeros")
+    
+    # 指定形式で保存
+    x_dir = os.path.join(output_dir, str(zoom), str(tx))
+    save_tile(elevation_grid, os.path.join(x_dir, str(ty)), tile_format, work_file=work_file)
+    
+    return (tx, ty, True, "Success")
+
+def base_tiles_per_block(tile_span_merc, inv_gt1, inv_gt5):
+    """1回の読み込みがBASE_BLOCK_MAX_PIXELS四方に収まるよう、1ブロックあたりのタイル数（1辺）を計算"""
+    # 1タイルが覆うピクセル数（窓の端数分として1ピクセルを加える）
+    tile_pixels = tile_span_merc * max(abs(inv_gt1), abs(inv_gt5)) + 1
+    return max(1, int(BASE_BLOCK_MAX_PIXELS // tile_pixels))
+
+def generate_base_tile_block(args):
+    """ブロック内の複数のベースタイルを1回のラスター読み込みで生成（マルチプロセッシング用）"""
+    (block_tiles, zoom, tile_size, input_file, output_dir, geotransform, inv_gt1, inv_gt5,
+     tile_span_merc, nodata_value, minx, miny, maxx, maxy, tile_format, work_file) = args
+    
+    # ワーカーで開いておいたGDALデータセットを使用
+    if not get_worker_dataset(input_file):
+        return [(tx, ty, False, "Could not open dataset") for tx, ty in block_tiles]
+    
+    # 各タイルの読み込み範囲を求め、ブロック全体を覆う範囲を計算
+    results = []
+    tile_windows = []
+    for tx, ty in block_tiles:
+        window = base_tile_window(tx, ty, zoom, geotransform, inv_gt1, inv_gt5, tile_span_merc,
+                                  minx, miny, maxx, maxy, _worker_raster_size)
+        if isinstance(window, str):
+            results.append((tx, ty, False, window))
+        else:
+            tile_windows.append((tx, ty) + window)
+    
+    if not tile_windows:
+        return results
+    
+    block_minx = min(window[0] for _, _, _, window in tile_windows)
+    block_miny = min(window[1] for _, _, _, window in tile_windows)
+    block_maxx = max(window[2] for _, _, _, window in tile_windows)
+    block_maxy = max(window[3] for _, _, _, window in tile_windows)
+    width = block_maxx - block_minx
+    height = block_maxy - block_miny
     
     try:
-        # GDALデータセットを再オープン
-        dataset = gdal.Open(input_file, gdal.GA_ReadOnly)
-        if not dataset:
-            return (tx, ty, False, "Could not open dataset")
-        
-        band = dataset.GetRasterBand(1)
-        
-        # タイルの地理的範囲を計算（WGS84）
-        north, west = num2deg(tx, ty, zoom)
-        south, east = num2deg(tx + 1, ty + 1, zoom)
-        
-        # WGS84からWeb Mercatorに変換
-        def wgs84_to_webmercator(lat, lon):
-            x = lon * 20037508.342789244 / 180.0
-            y = math.log(math.tan((90.0 + lat) * math.pi / 360.0)) * 20037508.342789244 / math.pi
-            return x, y
-        
-        tile_west_merc, tile_north_merc = wgs84_to_webmercator(north, west)
-        tile_east_merc, tile_south_merc = wgs84_to_webmercator(south, east)
-        
-        # タイルとラスターの重複領域を計算
-        overlap_minx = max(tile_west_merc, minx)
-        overlap_maxx = min(tile_east_merc, maxx)
-        overlap_miny = max(tile_south_merc, miny)
-        overlap_maxy = min(tile_north_merc, maxy)
-        
-        # 重複がない場合はスキップ
-        if overlap_minx >= overlap_maxx or overlap_miny >= overlap_maxy:
-            dataset = None
-            return (tx, ty, False, "No overlap")
-        
-        # ラスター座標系での範囲を計算
-        pixel_minx = max(0, int((overlap_minx - geotransform[0]) / geotransform[1]))
-        pixel_maxx = min(dataset.RasterXSize, int((overlap_maxx - geotransform[0]) / geotransform[1]) + 1)
-        pixel_miny = max(0, int((overlap_maxy - geotransform[3]) / geotransform[5]))
-        pixel_maxy = min(dataset.RasterYSize, int((overlap_miny - geotransform[3]) / geotransform[5]) + 1)
-        
-        if pixel_minx >= pixel_maxx or pixel_miny >= pixel_maxy:
-            dataset = None
-            return (tx, ty, False, "Invalid pixel range")
-        
-        # ラスターデータを読み込み
-        width = pixel_maxx - pixel_minx
-        height = pixel_maxy - pixel_miny
+        # ブロック全体を作業バッファにfloat型で1度だけ読み込む
+        block_data = _worker_band.ReadAsArray(block_minx, block_miny, width, height,
+                                              buf_obj=get_read_buffer(height, width))
+        if block_data is None:
+            return results + [(tx, ty, False, "Could not read data") for tx, ty, _, _ in tile_windows]
         
-        if width <= 0 or height <= 0:
-            dataset = None
-            return (tx, ty, False, "Invalid dimensions")
-        
-        data = band.ReadAsArray(pixel_minx, pixel_miny, width, height)
-        
-        if data is None:
-            dataset = None
-            return (tx, ty, False, "Could not read data")
-        
-        # データをfloat型に変換
-        data = data.astype(np.float32)
-        
-        # NaNや無効値を処理
+        # NaNや無効値を処理（ブロック全体で1度だけ）
         if nodata_value is not None:
-            data = np.where(data == nodata_value, np.nan, data)
-        
-        # タイル内でのグリッドポイントを生成
-        elevation_grid = np.full((tile_size, tile_size), np.nan, dtype=np.float32)
-        
-        for i in range(tile_size):
-            for j in range(tile_size):
-                # グリッドポイントの地理的座標（WGS84）
-                point_lat = north - (north - south) * i / (tile_size - 1)
-                point_lon = west + (east - west) * j / (tile_size - 1)
-                
-                # Web Mercator座標に変換
-                point_x, point_y = wgs84_to_webmercator(point_lat, point_lon)
-                
-                # ラスター座標系に変換
-                raster_x = (point_x - geotransform[0]) / geotransform[1]
-                raster_y = (point_y - geotransform[3]) / geotransform[5]
-                
-                # ラスター範囲内かチェック
-                if (pixel_minx <= raster_x < pixel_maxx and 
-                    pixel_miny <= raster_y < pixel_maxy):
-                    
-                    # ローカル座標に変換（bilinear補間用）
-                    local_x = raster_x - pixel_minx
-                    local_y = raster_y - pixel_miny
-                    
-                    # Bilinear補間を実行
-                    value = bilinear_interpolation(data, local_x, local_y, width, height)
-                    if not np.isnan(value):
-                        elevation_grid[i, j] = value
-        
-        # NaNを0に変換
-        elevation_grid = np.where(np.isnan(elevation_grid), 0.0, elevation_grid)
-        
-        # 全面0.00の場合はタイル出力をスキップ
-        if np.all(elevation_grid == 0.0):
-            dataset = None
-            return (tx, ty, False, "All zeros")
-        
-        # テキストファイルに保存
-        x_dir = os.path.join(output_dir, str(zoom), str(tx))
-        os.makedirs(x_dir, exist_ok=True)
-        tile_file = os.path.join(x_dir, f"{ty}.txt")
-        save_tile_data(elevation_grid, tile_file)
-        
-        dataset = None
-        return (tx, ty, True, "Success")
-        
+            block_data[block_data == nodata_value] = np.nan
     except Exception as e:
-        return (tx, ty, False, f"Error: {str(e)}")
+        return results + [(tx, ty, False, f"Error: {str(e)}") for tx, ty, _, _ in tile_windows]
+    
+    for tx, ty, bounds, window in tile_windows:
+        pixel_minx, pixel_miny, pixel_maxx, pixel_maxy = window
+        try:
+            # タイルごとの読み込み範囲をブロックのビューとして切り出す
+            data = block_data[pixel_miny - block_miny:pixel_maxy - block_miny,
+                              pixel_minx - block_minx:pixel_maxx - block_minx]
+            results.append(sample_base_tile(tx, ty, zoom, tile_size, output_dir, geotransform,
+                                            inv_gt1, inv_gt5, bounds, window, data, tile_format, work_file))
+        except Exception as e:
+            results.append((tx, ty, False, f"Error: {str(e)}"))
+    
+    return results
 
 def generate_base_zoom_tiles(dataset, band, geotransform, nodata_value,
                            minx, miny, maxx, maxy, min_lat, min_lon, max_lat, max_lon,
-                           zoom, tile_size, output_dir, num_processes=None, target_tiles=None):
-    """最高解像度のタイルを元データから並列処理で生成"""
+                           zoom, tile_size, output_dir, num_processes=None, target_tiles=None, tile_format='txt',
+                           work_files=True):
+    """最高解像度のタイルを元データから並列処理で生成し、出力したタイル座標の集合を返す
+    
+    work_filesがFalseの場合はピラミッド生成用の作業データを書き出さない（ピラミッドを生成しない場合）。
+    """
     
     if num_processes is None:
         num_processes = min(cpu_count(), 8)  # 最大8プロセス
     
     print(f"  Using {num_processes} processes for parallel tile generation")
     
-    # このズームレベルでのタイル範囲を計算（常に実行）
-    min_tile_x, max_tile_y = deg2num(min_lat, min_lon, zoom)
-    max_tile_x, min_tile_y = deg2num(max_lat, max_lon, zoom)
-    
-    # タイル範囲を調整
-    min_tile_x = max(0, min_tile_x)
-    max_tile_x = min(2**zoom - 1, max_tile_x)
-    min_tile_y = max(0, min_tile_y)
-    max_tile_y = min(2**zoom - 1, max_tile_y)
+    # このズームレベルでのタイル範囲を計算（常に実行、南西・北東の2隅を一括変換）
+    corner_x, corner_y = deg2num_vec([min_lat, max_lat], [min_lon, max_lon], zoom)
+    min_tile_x, max_tile_x = int(corner_x[0]), int(corner_x[1])
+    max_tile_y, min_tile_y = int(corner_y[0]), int(corner_y[1])
     
     print(f"  Tile range: x={min_tile_x}-{max_tile_x}, y={min_tile_y}-{max_tile_y}")
     
     # ラスタ範囲内の全タイル座標のリストを生成
-    raster_tile_coords = []
-    for tx in range(min_tile_x, max_tile_x + 1):
-        for ty in range(min_tile_y, max_tile_y + 1):
-            raster_tile_coords.append((tx, ty))
+    # 行優先（ty→tx）の順に並べ、各ワーカーに連続したチャンクとして渡すことで
+    # 隣接タイルが同じソースブロック（ストリップ/内部タイル）をGDALのブロックキャッシュから再利用できるようにする
+    raster_tys, raster_txs = np.mgrid[min_tile_y:max_tile_y + 1, min_tile_x:max_tile_x + 1].astype(np.int64)
+    raster_txs = raster_txs.ravel()
+    raster_tys = raster_tys.ravel()
     
-    # 対象タイルが指定されている場合は交集合を取る
+    # 対象タイルが指定されている場合は交集合を取る（整数キーで一括判定）
     if target_tiles and zoom in target_tiles:
         target_tile_set = target_tiles[zoom]
-        tile_coords = [(tx, ty) for tx, ty in raster_tile_coords if (tx, ty) in target_tile_set]
-        print(f"  Raster tiles: {len(raster_tile_coords)}, Target tiles: {len(target_tile_set)}, Intersection: {len(tile_coords)} tiles")
+        target_keys = np.fromiter(target_tile_set, dtype=np.int64, count=len(target_tile_set))
+        in_target = np.isin(tile_key(raster_txs, raster_tys), target_keys)
+        tile_coords = list(zip(raster_txs[in_target].tolist(), raster_tys[in_target].tolist()))
+        print(f"  Raster tiles: {raster_txs.size}, Target tiles: {len(target_tile_set)}, Intersection: {len(tile_coords)} tiles")
     else:
-        tile_coords = raster_tile_coords
+        tile_coords = list(zip(raster_txs.tolist(), raster_tys.tolist()))
         print(f"  Processing all {len(tile_coords)} tiles in raster range")
     
     zoom_dir = os.path.join(output_dir, str(zoom))
     os.makedirs(zoom_dir, exist_ok=True)
+    create_tile_dirs(zoom_dir, (tx for tx, _ in tile_coords))
     
-    # 全タイルのタスクリストを作成
-    tasks = []
+    # ズームレベル内で共通の定数（ピクセルサイズの逆数、Web Mercatorでのタイル幅）はタスクに含めて渡す
+    inv_gt1 = 1.0 / geotransform[1]
+    inv_gt5 = 1.0 / geotransform[5]
+    tile_span_merc = 2.0 * MERC_SCALE / (1 << zoom)
+    
+    # block x block タイルごとに1タスクとし、ラスターの読み込みをまとめる
+    # （読み込み範囲がBASE_BLOCK_MAX_PIXELS四方に収まるタイル数をズームレベルごとに決める）
+    block = base_tiles_per_block(tile_span_merc, inv_gt1, inv_gt5)
+    blocks = {}
     for tx, ty in tile_coords:
-        task = (tx, ty, zoom, tile_size, dataset.GetDescription(), output_dir,
-               geotransform, nodata_value, minx, miny, maxx, maxy)
+        blocks.setdefault((ty // block, tx // block), []).append((tx, ty))
+    
+    tasks = []
+    for block_key in sorted(blocks):
+        task = (blocks[block_key], zoom, tile_size, dataset.GetDescription(), output_dir,
+                geotransform, inv_gt1, inv_gt5, tile_span_merc,
+                nodata_value, minx, miny, maxx, maxy, tile_format, work_files)
         tasks.append(task)
     
-    total_tasks = len(tasks)
-    print(f"  Processing {total_tasks} tiles...")
+    total_tasks = len(tile_coords)
+    print(f"  Processing {total_tasks} tiles in {len(tasks)} blocks of up to {block}x{block} tiles...")
     
     successful_tiles = 0
     failed_tiles = 0
     skipped_tiles = 0
+    produced_tiles = set()
+    skip_reasons = {}  # 空タイルの理由ごとの件数（データの疎らさの記録用）
     
     start_time = time.time()
     
-    # 並列処理でタイル生成
-    with Pool(processes=num_processes) as pool:
+    # 並列処理でタイル生成（各ワーカーはGDALデータセットを1度だけ開く）
+    # ブロックキャッシュはワーカーごとに持つため、上限をプロセス数で分割する
+    worker_cache_size = gdal_cache_size(num_processes)
+    print(f"  GDAL cache per worker: {worker_cache_size / 1024 ** 2:.0f} MB")
+    
+    with Pool(processes=num_processes, initializer=init_base_tile_worker,
+              initargs=(dataset.GetDescription(), worker_cache_size)) as pool:
         # 進捗表示のためチャンクサイズを調整
-        chunk_size = max(1, total_tasks // (num_processes * 4))
+        chunk_size = max(1, len(tasks) // (num_processes * 4))
         
-        results = pool.map(generate_single_base_tile, tasks, chunksize=chunk_size)
+        # 完了したブロックから順に結果を受け取り、全結果をメモリに溜めずに集計・進捗表示する
+        block_results = pool.imap_unordered(generate_base_tile_block, tasks, chunksize=chunk_size)
         
         # 結果を処理
+        results = (result for block in block_results for result in block)
         for i, (tx, ty, success, message) in enumerate(results):
             if success:
                 successful_tiles += 1
-            elif message == "No overlap" or message == "All zeros":
+                produced_tiles.add((tx, ty))
+            elif message in ("No overlap", "No data", "All zeros"):
                 skipped_tiles += 1
+                skip_reasons[message] = skip_reasons.get(message, 0) + 1
             else:
                 failed_tiles += 1
                 if failed_tiles <= 10:  # 最初の10個のエラーのみ表示
@@ -451,102 +731,151 @@ def generate_base_zoom_tiles(dataset, band, geotransform, nodata_value,
     end_time = time.time()
     total_time = end_time - start_time
     
+    # 全タイルがスキップされた列のディレクトリを片付ける
+    if skipped_tiles or failed_tiles:
+        remove_empty_tile_dirs(zoom_dir, (tx for tx, _ in tile_coords))
+    
     print(f"  Completed in {total_time:.1f}s")
     print(f"  Results: {successful_tiles} successful, {skipped_tiles} skipped, {failed_tiles} failed")
+    if skipped_tiles:
+        breakdown = ", ".join(f"{reason}: {count}" for reason, count in sorted(skip_reasons.items()))
+        print(f"  Empty tiles: {skipped_tiles / total_tasks * 100:.1f}% of range ({breakdown})")
     
-    return successful_tiles
+    return produced_tiles
+
+def parent_tile_coords(tx, ty):
+    """子タイルに対応する4つの親タイルの座標（左上、右上、左下、右下の順）"""
+    return [
+        (tx * 2, ty * 2),        # 左上
+        (tx * 2 + 1, ty * 2),    # 右上
+        (tx * 2, ty * 2 + 1),    # 左下
+        (tx * 2 + 1, ty * 2 + 1) # 右下
+    ]
 
-def generate_pyramid_level(output_dir, target_zoom, source_zoom, tile_size, target_tiles=None):
-    """親ズームレベルから子ズームレベルのタイルをリサンプリングで生成"""
+def init_pyramid_worker(source_tiles, target_tiles):
+    """ピラミッド生成ワーカーの初期化（タイル集合をタスクごとに送らないよう1度だけ受け取る）"""
+    global _pyramid_source_tiles, _pyramid_target_tiles
+    _pyramid_source_tiles = source_tiles
+    _pyramid_target_tiles = target_tiles
+
+def build_pyramid_tile(tx, ty, zoom, source_zoom, top_zoom, output_dir, tile_size, tile_format, counts):
+    """親タイルをメモリ上で再帰的に生成して子タイルを作成し、そのデータを返す（出力しない場合はNone）"""
+    if zoom == source_zoom:
+        # ソースズームレベルは作業データから読み込む
+        if (tx, ty) not in _pyramid_source_tiles:
+            return None
+        return load_tile_data(os.path.join(output_dir, str(zoom), str(tx), f"{ty}{PYRAMID_WORK_EXT}"))
+    
+    # 親タイル（より高いズームレベル）は対象外のタイルの下でも生成する必要があるため先に処理
+    parent_tiles = [build_pyramid_tile(ptx, pty, zoom + 1, source_zoom, top_zoom,
+                                       output_dir, tile_size, tile_format, counts)
+                    for ptx, pty in parent_tile_coords(tx, ty)]
+    
+    # CSVで対象外のタイルは生成しない（次のズームレベルの親タイルとしても使わない）
+    if _pyramid_target_tiles and zoom in _pyramid_target_tiles and tile_key(tx, ty) not in _pyramid_target_tiles[zoom]:
+        return None
+    
+    # 親タイルが1つもなければ全面0になるため生成しない
+    if all(parent_data is None for parent_data in parent_tiles):
+        return None
     
-    source_dir = os.path.join(output_dir, str(source_zoom))
-    target_dir = os.path.join(output_dir, str(target_zoom))
+    # ダウンサンプリング実行（存在しない親タイルは0で埋める）
+    downsampled = downsample_tile(parent_tiles, tile_size)
     
-    if not os.path.exists(source_dir):
-        print(f"  Warning: Source zoom directory {source_dir} does not exist")
-        return 0
+    # 全面0.00の場合はタイル出力をスキップ
+    if not downsampled.any():
+        return None
     
-    os.makedirs(target_dir, exist_ok=True)
+    # ターゲットタイルを保存（作業データは次のピラミッド生成で使う最上段のみ）
+    save_tile(downsampled, os.path.join(output_dir, str(zoom), str(tx), str(ty)), tile_format,
+              work_file=(zoom == top_zoom))
+    counts[zoom] = counts.get(zoom, 0) + 1
     
-    # ソースズームレベルのタイル一覧を取得
-    source_tiles = set()
-    for x_dir_name in os.listdir(source_dir):
-        x_dir_path = os.path.join(source_dir, x_dir_name)
-        if os.path.isdir(x_dir_path):
-            try:
-                tx = int(x_dir_name)
-                for tile_file in os.listdir(x_dir_path):
-                    if tile_file.endswith('.txt'):
-                        ty = int(tile_file[:-4])  # .txtを除去
-                        source_tiles.add((tx, ty))
-            except ValueError:
-                continue
+    return downsampled
+
+def generate_pyramid_subtree(args):
+    """top_zoomの1タイル以下のズームレベルをまとめて生成（マルチプロセッシング用）"""
+    top_tx, top_ty, top_zoom, source_zoom, output_dir, tile_size, tile_format, keep_work_file = args
+    
+    counts = {}
+    top_data = build_pyramid_tile(top_tx, top_ty, top_zoom, source_zoom,
+                                  top_zoom if keep_work_file else None,
+                                  output_dir, tile_size, tile_format, counts)
+    return (top_tx, top_ty, top_data is not None, counts)
+
+def generate_pyramid_levels(output_dir, top_zoom, source_zoom, source_tiles, tile_size, target_tiles=None, tile_format='txt', num_processes=None, keep_work_files=False):
+    """ソースズームレベルからtop_zoomまでの各ズームレベルを、中間レベルをメモリ上に保持したまま生成
+    
+    source_tilesはソースズームレベルで作業データを出力したタイル座標の集合。
+    戻り値は(ズームレベルごとの生成タイル数, top_zoomで出力したタイル座標の集合)。
+    """
+    
+    if num_processes is None:
+        num_processes = min(cpu_count(), 8)  # 最大8プロセス
+    
+    source_coords = np.array(list(source_tiles), dtype=np.int64).reshape(-1, 2)
+    source_txs, source_tys = source_coords[:, 0], source_coords[:, 1]
     
     print(f"  Found {len(source_tiles)} source tiles at zoom {source_zoom}")
     
-    # ターゲットズームレベルのタイル範囲を計算
-    if target_tiles and target_zoom in target_tiles:
-        # CSVで指定されたタイルのみを対象とする
-        target_tiles_coords = target_tiles[target_zoom]
-        print(f"  Using target tiles from CSV: {len(target_tiles_coords)} tiles at zoom {target_zoom}")
+    # top_zoomのタイル1枚を1タスクとし、その下のズームレベルを1つのワーカーで生成
+    # （ビットシフトとnp.uniqueで一括計算し、x→yの順に並べる）
+    shift = source_zoom - top_zoom
+    top_tiles = np.unique(np.stack([source_txs >> shift, source_tys >> shift], axis=1), axis=0)
+    
+    # 各ズームレベルの出力先のxディレクトリを事前に作成
+    tile_xs_by_zoom = {zoom: np.unique(source_txs >> (source_zoom - zoom)).tolist()
+                       for zoom in range(top_zoom, source_zoom)}
+    for zoom, tile_xs in tile_xs_by_zoom.items():
+        create_tile_dirs(os.path.join(output_dir, str(zoom)), tile_xs)
+    
+    print(f"  Generating {len(top_tiles)} subtrees rooted at zoom {top_zoom}")
+    
+    tasks = [(top_tx, top_ty, top_zoom, source_zoom, output_dir, tile_size, tile_format, keep_work_files)
+             for top_tx, top_ty in top_tiles.tolist()]
+    
+    level_counts = {zoom: 0 for zoom in range(top_zoom, source_zoom)}
+    top_produced = set()
+    
+    def collect(results):
+        for top_tx, top_ty, produced, counts in results:
+            if produced:
+                top_produced.add((top_tx, top_ty))
+            for zoom, count in counts.items():
+                level_counts[zoom] += count
+    
+    # 1タスクのみの場合はプロセス起動コストを避けて逐次処理
+    if num_processes <= 1 or len(tasks) <= 1:
+        init_pyramid_worker(source_tiles, target_tiles)
+        collect(map(generate_pyramid_subtree, tasks))
     else:
-        # ソースタイルから計算
-        target_tiles_coords = set()
-        for source_tx, source_ty in source_tiles:
-            # 親タイルから子タイルの座標を計算
-            target_tx = source_tx // 2
-            target_ty = source_ty // 2
-            target_tiles_coords.add((target_tx, target_ty))
-    
-    print(f"  Generating {len(target_tiles_coords)} target tiles at zoom {target_zoom}")
-    
-    generated_count = 0
-    
-    for target_tx, target_ty in target_tiles_coords:
-        # 4つの親タイルの座標
-        parent_tiles_coords = [
-            (target_tx * 2, target_ty * 2),        # 左上
-            (target_tx * 2 + 1, target_ty * 2),    # 右上
-            (target_tx * 2, target_ty * 2 + 1),    # 左下
-            (target_tx * 2 + 1, target_ty * 2 + 1) # 右下
-        ]
-        
-        # 親タイルのデータを読み込み
-        parent_tiles = []
-        all_loaded = True
-        
-        for ptx, pty in parent_tiles_coords:
-            parent_file = os.path.join(source_dir, str(ptx), f"{pty}.txt")
-            parent_data = load_tile_data(parent_file)
-            
-            if parent_data is not None:
-                parent_tiles.append(parent_data)
-            else:
-                # 存在しない親タイルは0で埋める
-                parent_tiles.append(np.zeros((tile_size, tile_size), dtype=np.float32))
-        
-        if len(parent_tiles) == 4:
-            # ダウンサンプリング実行
-            downsampled = downsample_tile(parent_tiles, tile_size)
-            
-            # 全面0.00の場合はタイル出力をスキップ
-            if np.all(downsampled == 0.0):
-                continue
-            
-            # ターゲットタイルを保存
-            target_x_dir = os.path.join(target_dir, str(target_tx))
-            target_file = os.path.join(target_x_dir, f"{target_ty}.txt")
-            save_tile_data(downsampled, target_file)
-            
-            generated_count += 1
+        # 並列処理で子タイルを生成（各タスクは複数ズームレベル分の処理を含むため1件ずつ配布）
+        with Pool(processes=num_processes, initializer=init_pyramid_worker,
+                  initargs=(source_tiles, target_tiles)) as pool:
+            collect(pool.imap_unordered(generate_pyramid_subtree, tasks))
     
-    return generated_count
+    # タイルが1つも出力されなかった列のディレクトリを片付ける
+    for zoom, tile_xs in tile_xs_by_zoom.items():
+        remove_empty_tile_dirs(os.path.join(output_dir, str(zoom)), tile_xs)
+    
+    return level_counts, top_produced
 
 if __name__ == "__main__":
+    # --format オプションを位置引数から取り出す
+    tile_format = 'txt'
+    if '--format' in sys.argv:
+        format_index = sys.argv.index('--format')
+        if format_index + 1 >= len(sys.argv) or sys.argv[format_index + 1] not in TILE_FORMATS:
+            print(f"Error: --format must be one of {', '.join(TILE_FORMATS)}")
+            sys.exit(1)
+        tile_format = sys.argv[format_index + 1]
+        del sys.argv[format_index:format_index + 2]
+    
     if len(sys.argv) < 6 or len(sys.argv) > 8:
-        print("Usage: python3 generate_text_tiles.py <input_file> <output_dir> <min_zoom> <max_zoom> <tile_size> [num_processes] [target_tiles_csv]")
+        print("Usage: python3 generate_text_tiles.py <input_file> <output_dir> <min_zoom> <max_zoom> <tile_size> [num_processes] [target_tiles_csv] [--format txt|png|both]")
         print("  num_processes: Number of parallel processes (default: auto-detect, max 8)")
         print("  target_tiles_csv: CSV file with target tile IDs (z,x,y format)")
+        print("  --format: Output tile format (txt: elevation text, png: terrain RGB PNG, both; default: txt)")
         sys.exit(1)
     
     input_file = sys.argv[1]
@@ -574,6 +903,6 @@ if __name__ == "__main__":
         target_tiles_csv = sys.argv[6]
         num_processes = None
     
-    success = generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, num_processes, target_tiles_csv)
+    success = generate_text_tiles(input_file, output_dir, min_zoom, max_zoom, tile_size, num_processes, target_tiles_csv, tile_format)
     if not success:
         sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""
+Terrain RGBエンコード
+
+標高値配列をterrain RGB PNGタイルに変換します。
+terrain RGB形式: 標高 = -10000 + ((R * 256 * 256 + G * 256 + B) * 0.1)
+"""
+
+import numpy as np
+from PIL import Image
+
+# Try to import imagecodecs PNG encoder, fallback to Pillow if not available
+try:
+    import imagecodecs
+    HAS_IMAGECODECS = True
+except ImportError:
+    HAS_IMAGECODECS = False
+
+
+def encode_terrain_rgb(elevation):
+    """
+    標高値配列をterrain RGB形式に変換
+
+    Args:
+        elevation (np.ndarray): (H, W) の標高値配列（メートル）
+
+    Returns:
+        np.ndarray: (H, W, 3) のuint8 RGB配列
+    """
+    # (R * 256 * 256 + G * 256 + B) = (標高 + 10000) / 0.1
+    # タイル全体をまとめてエンコードし、0〜2^24-1の範囲に制限
+    encoded = np.clip(np.rint((elevation + 10000.0) * 10.0).astype(np.int32), 0, 0xFFFFFF)
+
+    # RGB値に分解
+    rgb_array = np.empty(elevation.shape + (3,), dtype=np.uint8)
+    rgb_array[..., 0] = (encoded >> 16) & 0xFF
+    rgb_array[..., 1] = (encoded >> 8) & 0xFF
+    rgb_array[..., 2] = encoded & 0xFF
+
+    return rgb_array
+
+
+def save_terrain_rgb_png(elevation, png_file, compress_level=1):
+    """
+    標高値配列をterrain RGB PNGとして保存
+
+    terrain RGBは圧縮レベルを上げてもファイルサイズの差が小さく書き込み時間の
+    方が支配的なため、既定では最速の圧縮レベル1で書き出します。
+
+    Args:
+        elevation (np.ndarray): (H, W) の標高値配列（メートル）
+        png_file (str): 出力PNGファイルパス
+        compress_level (int): PNGのzlib圧縮レベル（0〜9）
+    """
+    rgb_array = encode_terrain_rgb(elevation)
+
+    if HAS_IMAGECODECS:
+        # imagecodecsのPNGエンコーダ（SIMD対応のzlib/libpng）で書き出す
+        with open(png_file, 'wb') as f:
+            f.write(imagecodecs.png_encode(rgb_array, level=compress_level))
+        return
+
+    # RGBモードはPillow内部の画素形式（4バイト/画素）と異なるため、fromarrayでのコピーは避けられない
+    image = Image.fromarray(rgb_array, 'RGB')
+    image.save(png_file, 'PNG', compress_level=compress_level, optimize=False)